@@ -1,72 +1,283 @@
 import asyncio
 import base64
-import json
+import concurrent.futures
+import email.utils
+import hashlib
+import inspect
+import os
+import sys
+import tempfile
+import threading
+import time
 import traceback
-import nest_asyncio
-import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI
+import weakref
+import aiohttp
+import cachetools
+import orjson
+from lxml import etree, html
+from openai import NotFoundError, OpenAI
+from openai.types.beta import AssistantToolParam
+from pydantic import TypeAdapter
 import streamlit as st
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
 openai_api_key = st.secrets["api_keys"]["openai_api_key"]
 proxy_api_key = st.secrets["api_keys"]["proxy_api_key"]
 
 # Initialize the OpenAI client with the secure API key
 client = OpenAI(api_key=openai_api_key)
 
-# Global thread initialization
-if 'user_thread' not in st.session_state:
-    st.session_state.user_thread = client.beta.threads.create()
+# Global thread initialization; the thread lives only as long as the browser session, alongside its visible history
+if 'thread_id' not in st.session_state:
+    st.session_state.thread_id = client.beta.threads.create().id
 
 # Proxy setup
 PROXY_URL = 'https://proxy.scrapeops.io/v1/'
 API_KEY = proxy_api_key
 
-def scrape_content(url):
-    """Fetches HTML from the target URL using the proxy service, extracts text content, and deduplicates href links."""
-    params = {
+# Retry policy for proxy requests
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = [429, 502, 503, 504]
+# Longest Retry-After wait honoured before retrying, in seconds
+MAX_RETRY_AFTER = 60
+
+# Proxy connect and read timeouts, in seconds; rendering JavaScript can make the proxy slow to answer
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+# Ask the proxy for compressed responses; aiohttp decompresses gzip and deflate natively and brotli via the brotli package
+ACCEPT_ENCODING_HEADERS = {'Accept-Encoding': 'gzip, deflate, br'}
+
+# Size of the body chunks fed to the HTML parser while a page downloads
+CHUNK_SIZE = 65536
+
+# Elements whose text is not visible on the page
+HIDDEN_TAGS = {'script', 'style'}
+
+# Maximum characters of page text returned to the assistant per scrape
+MAX_CONTENT_CHARS = 60_000
+TRUNCATION_MARKER = "\n[content truncated: the page continues beyond this point]"
+
+def proxy_params(url):
+    """Builds the proxy query parameters for scraping the given URL."""
+    return {
         'api_key': API_KEY,
         'url': url,
         'render_js': 'true',
         'residential': 'true',
     }
+
+def new_html_parser():
+    """Returns an lxml parser to feed a page body into chunk by chunk, decoding it as UTF-8."""
+    return html.HTMLParser(encoding='utf-8')
+
+def parse_html(parser):
+    """Closes a fed HTML parser and extracts text content and deduplicated href links from its tree."""
+    try:
+        root = parser.close()
+    except etree.XMLSyntaxError:
+        # Raised when the body was empty
+        root = None
+    if root is None:
+        return {'content': "", 'truncated': False, 'links': []}
+
+    # Collect text and href links in a single walk over the tree. Element text is visible
+    # at "start"; tails follow an element's children, so they are taken at "end", and for
+    # comments (whose own text is hidden) at the comment event.
+    parts = []
+    hrefs = set()
+    for event, element in etree.iterwalk(root, events=('start', 'end', 'comment', 'pi')):
+        if event == 'start':
+            if element.tag == 'a':
+                href = element.get('href')
+                if href:
+                    # Interned so links repeated across scraped pages share one string in memory
+                    hrefs.add(sys.intern(href))
+            if element.text and element.tag not in HIDDEN_TAGS:
+                parts.append(element.text)
+        elif element.tail and element is not root:
+            parts.append(element.tail)
+
+    # One stripped string per line, matching BeautifulSoup's get_text output
+    content = "\n".join(filter(None, (part.strip() for part in parts)))
+    # Cap the text so a huge page doesn't turn into a huge token bill on the next run step,
+    # and say so, so the model doesn't treat a partial page as the whole document
+    truncated = len(content) > MAX_CONTENT_CHARS
+    if truncated:
+        content = content[:MAX_CONTENT_CHARS] + TRUNCATION_MARKER
+    links = sorted(hrefs)
     
+    return {
+        'content': content,
+        'truncated': truncated,
+        'links': links  # Return the sorted list of links
+    }
+
+class ScrapeStatusError(Exception):
+    """Raised when the proxy answers a scrape with a non-200 status."""
+
+class PageCache:
+    """Thread-safe TTL cache of scraped pages keyed on URL. Failures are never stored."""
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self._pages = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return self._pages.get(url)
+
+    def put(self, url, page):
+        with self._lock:
+            self._pages[url] = page
+
+@st.cache_resource
+def get_page_cache():
+    """Returns the process-wide page cache shared by all sessions."""
+    return PageCache()
+
+def retry_delay(attempt, response=None):
+    """Returns the wait before retrying a failed attempt (0-based).
+
+    A Retry-After header on the response is honoured, up to MAX_RETRY_AFTER; otherwise the wait backs off exponentially.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        if retry_after.isdigit():
+            return min(int(retry_after), MAX_RETRY_AFTER)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after).timestamp()
+        except (TypeError, ValueError):
+            pass
+        else:
+            return min(max(retry_at - time.time(), 0), MAX_RETRY_AFTER)
+    return 0 if attempt == 0 else RETRY_BACKOFF_FACTOR * 2 ** attempt
+
+async def fetch_content(http, url):
+    """Fetches and parses a single URL through the proxy on an aiohttp session, retrying transient failures."""
+    for attempt in range(RETRY_TOTAL + 1):
+        response = None
+        try:
+            async with http.get(PROXY_URL, params=proxy_params(url)) as response:
+                if response.status == 200:
+                    # Feed the body to lxml as it arrives so parsing overlaps the download
+                    parser = new_html_parser()
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        parser.feed(chunk)
+                    return parse_html(parser)
+                if response.status not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                    raise ScrapeStatusError(f"Failed to fetch the page: {url}, status code: {response.status}")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == RETRY_TOTAL:
+                raise
+        await asyncio.sleep(retry_delay(attempt, response))
+
+def close_async_resources(loop, clients):
+    """Closes a session's aiohttp clients and then its event loop.
+
+    The finalizer can fire on any thread, including Streamlit's server thread, which already runs
+    its own event loop and so cannot drive this one. In that case the work moves to a short-lived thread.
+    """
+    def close():
+        if loop.is_running() or loop.is_closed():
+            return
+        for http in clients:
+            if not http.closed:
+                loop.run_until_complete(http.close())
+        loop.close()
+
     try:
-        with st.spinner(f"Scraping content from {url}..."):
-            # Make the request to the proxy service
-            response = requests.get(PROXY_URL, params=params)
-            response.encoding = 'utf-8'  # Enforce UTF-8 encoding
-            
-            # Check if the request was successful
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Extract and clean the text content
-                content = soup.get_text(separator="\n", strip=True)
-                
-                # Extract and deduplicate href links using set comprehension
-                links = sorted({a.get('href') for a in soup.find_all('a', href=True) if a.get('href')})
-                
-                st.success(f"Successfully scraped content from {url}")
-                return {
-                    'content': content,
-                    'links': links  # Return the sorted list of links
-                }
-            else:
-                st.error(f"Failed to fetch the page: {url}, status code: {response.status_code}")
-                return None
-    except requests.exceptions.Timeout:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # No loop running on this thread, e.g. at process exit
+        close()
+    else:
+        threading.Thread(target=close, name="close-session-async-resources").start()
+
+class SessionAsyncResources:
+    """A session's event loop and aiohttp client, kept across reruns so connection pools survive between turns.
+
+    Both are closed when Streamlit discards the session's state, or at process exit, whichever comes first.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._clients = []
+        weakref.finalize(self, close_async_resources, self.loop, self._clients)
+
+    def http_session(self):
+        """Returns the aiohttp client, creating it on first use. Must be called on self.loop."""
+        if not self._clients or self._clients[-1].closed:
+            connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+            self._clients.append(aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers=ACCEPT_ENCODING_HEADERS
+            ))
+        return self._clients[-1]
+
+def get_async_resources():
+    """Returns this session's event loop and aiohttp client holder."""
+    if 'async_resources' not in st.session_state:
+        st.session_state.async_resources = SessionAsyncResources()
+    return st.session_state.async_resources
+
+def get_event_loop():
+    """Returns this session's long-lived event loop."""
+    return get_async_resources().loop
+
+def get_http_session():
+    """Returns this session's aiohttp client. Must be called on the session's loop."""
+    return get_async_resources().http_session()
+
+async def scrape_many(urls):
+    """Scrapes several URLs concurrently; a failed URL yields its exception in place of a result."""
+    http = get_http_session()
+    return await asyncio.gather(*[fetch_content(http, url) for url in urls], return_exceptions=True)
+
+def report_scrape(url, result):
+    """Reports the outcome of a scrape in the UI and returns the page, or None if the scrape failed."""
+    if isinstance(result, asyncio.TimeoutError):
         st.error(f"Request timed out while trying to scrape {url}.")
-        return None
-    except requests.exceptions.TooManyRedirects:
+    elif isinstance(result, aiohttp.TooManyRedirects):
         st.error(f"Too many redirects while trying to scrape {url}.")
-        return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"An error occurred while scraping {url}: {e}")
-        return None
+    elif isinstance(result, ScrapeStatusError):
+        st.error(str(result))
+    elif isinstance(result, Exception):
+        st.error(f"An error occurred while scraping {url}: {result}")
+    else:
+        st.success(f"Successfully scraped content from {url}")
+        return result
+    return None
+
+async def scrape_batch_with_feedback(urls):
+    """Scrapes the URLs, fetching only distinct uncached ones concurrently, and reports each outcome in the UI.
+
+    Returns one tool output per entry in urls, in the same order.
+    """
+    cache = get_page_cache()
+    unique_urls = list(dict.fromkeys(urls))
+    results = {url: cache.get(url) for url in unique_urls}
+
+    misses = [url for url, page in results.items() if page is None]
+    fetched = await scrape_many(misses) if misses else []
+    for url, result in zip(misses, fetched):
+        if not isinstance(result, Exception):
+            cache.put(url, result)
+        results[url] = result
+
+    outputs = {url: report_scrape(url, result) for url, result in results.items()}
+    return [
+        outputs[url] if outputs[url] is not None else "No content returned from scrape_content"
+        for url in urls
+    ]
+
+async def scrape_content(url):
+    """Scrapes a single URL through the same cached path as batched scrapes and reports the outcome in the UI."""
+    if not isinstance(url, str):
+        raise TypeError("url must be a string")
+    return (await scrape_batch_with_feedback([url]))[0]
 
 # Define function specifications for content scraping
 tools = [
@@ -96,6 +307,14 @@ available_functions = {
     "scrape_content": scrape_content,
 }
 
+@st.cache_resource(show_spinner=False)
+def validate_tools(tools_json):
+    """Validates the tool schema once per process and whenever it changes, since the cache is keyed on its JSON."""
+    TypeAdapter(list[AssistantToolParam]).validate_python(orjson.loads(tools_json))
+
+# Validate at startup so a malformed entry fails here rather than at the first create_assistant call
+validate_tools(orjson.dumps(tools))
+
 
 # Instructions for the assistant
 instructions = """
@@ -137,12 +356,34 @@ This applies under Jamaican jurisdiction. Shall I search for more cases or legal
 
 """
 
+# Model backing created assistants
+ASSISTANT_MODEL = "gpt-4o-mini"
+
+# Stable fingerprint of the assistant configuration. It is stored on assistants together with the
+# uploaded file contents so an equivalent assistant can be reused instead of created again.
+_ASSISTANT_CONFIG_HASH = hashlib.blake2b(
+    b"\0".join([instructions.encode(), orjson.dumps(tools, option=orjson.OPT_SORT_KEYS), ASSISTANT_MODEL.encode()]),
+    digest_size=8
+).hexdigest()
+
+def assistant_fingerprint(file_hashes):
+    """Returns an order-independent fingerprint of the assistant configuration and the given file content hashes."""
+    key = "\n".join([_ASSISTANT_CONFIG_HASH, *sorted(file_hashes)])
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+def find_assistant(fingerprint):
+    """Returns the ID of an existing assistant tagged with the given fingerprint, or None."""
+    for existing in client.beta.assistants.list(limit=100).data:
+        if (existing.metadata or {}).get("fingerprint") == fingerprint:
+            return existing.id
+    return None
+
 # Function to create an assistant
-def create_assistant(file_ids):
+def create_assistant(file_ids, fingerprint):
     assistant = client.beta.assistants.create(
         name="LegalAI assistant",
         instructions=instructions,
-        model="gpt-4o-mini",
+        model=ASSISTANT_MODEL,
         tools=tools,
         tool_resources={
             'file_search': {
@@ -150,41 +391,72 @@ def create_assistant(file_ids):
                     'file_ids': file_ids
                 }]
             }
-        }
+        },
+        metadata={"fingerprint": fingerprint}
     )
     return assistant.id
 
-def safe_tool_call(func, tool_name, **kwargs):
-    """Safely execute a tool call and handle exceptions."""
+async def safe_tool_call(func, tool_name, **kwargs):
+    """Safely execute a tool call, sync or async, and handle exceptions."""
     try:
         result = func(**kwargs)
+        if inspect.isawaitable(result):
+            result = await result
         return result if result is not None else f"No content returned from {tool_name}"
     except Exception as e:
         st.error(f"Error in {tool_name}: {str(e)}")
         return f"Error occurred in {tool_name}: {str(e)}"
     
+def parse_tool_arguments(call):
+    """Returns a tool call's JSON arguments as a dict, or an empty dict if they are malformed."""
+    try:
+        arguments = orjson.loads(call.function.arguments)
+    except orjson.JSONDecodeError:
+        return {}
+    return arguments if isinstance(arguments, dict) else {}
+
     # Function to handle tool outputs
-def handle_tool_outputs(run):
+async def handle_tool_outputs(run):
     tool_outputs = []
     try:
-        for call in run.required_action.submit_tool_outputs.tool_calls:
-            function_name = call.function.name
-            function = available_functions.get(function_name)
-            if not function:
-                raise ValueError(f"Function {function_name} not found in available_functions.")
-            arguments = json.loads(call.function.arguments)
-            # Use safe_tool_call if necessary
-            with st.spinner(f"Executing a detailed search..."):
-                output = safe_tool_call(function, function_name, **arguments)
-
-            tool_outputs.append({
-                "tool_call_id": call.id,
-                "output": json.dumps(output)
-            })
+        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+
+        # One spinner for the whole batch of tool calls rather than one per call
+        with st.spinner("Executing a detailed search..."):
+            # Parse each call's arguments on its own so one malformed call can't fail the whole run
+            arguments_by_call = {call.id: parse_tool_arguments(call) for call in tool_calls}
+
+            # Fan out all well-formed scrape calls at once so their network latencies overlap and cache hits are shared
+            scrape_calls = [
+                call for call in tool_calls
+                if call.function.name == "scrape_content"
+                and isinstance(arguments_by_call[call.id].get("url"), str)
+            ]
+            batched_outputs = {}
+            if scrape_calls:
+                urls = [arguments_by_call[call.id]["url"] for call in scrape_calls]
+                batched_outputs = dict(zip((call.id for call in scrape_calls), await scrape_batch_with_feedback(urls)))
+
+            for call in tool_calls:
+                if call.id in batched_outputs:
+                    output = batched_outputs[call.id]
+                else:
+                    function_name = call.function.name
+                    function = available_functions.get(function_name)
+                    if not function:
+                        raise ValueError(f"Function {function_name} not found in available_functions.")
+                    # Use safe_tool_call so bad arguments come back to the model as an error output
+                    output = await safe_tool_call(function, function_name, **arguments_by_call[call.id])
+
+                tool_outputs.append({
+                    "tool_call_id": call.id,
+                    "output": orjson.dumps(output).decode()
+                })
 
         # Use the correct user-specific thread ID here
-        return client.beta.threads.runs.submit_tool_outputs(
-            thread_id=st.session_state.user_thread.id,
+        return await asyncio.to_thread(
+            client.beta.threads.runs.submit_tool_outputs,
+            thread_id=st.session_state.thread_id,
             run_id=run.id,
             tool_outputs=tool_outputs
         )
@@ -194,32 +466,96 @@ def handle_tool_outputs(run):
         return None
 
 
+# Maximum number of downloaded files kept on disk per session; the oldest are removed first
+MAX_SESSION_DOWNLOADS = 50
+
+def get_download_dir():
+    """Returns this session's download directory, which is deleted once the session's state is discarded."""
+    if 'download_dir' not in st.session_state:
+        st.session_state.download_dir = tempfile.TemporaryDirectory(prefix="legalai-downloads-")
+        st.session_state.download_paths = []
+    return st.session_state.download_dir.name
+
+def download_to_temp_file(file_id, download_dir):
+    """Streams an OpenAI file into the download directory and returns its path."""
+    with client.files.with_streaming_response.content(file_id) as response:
+        with tempfile.NamedTemporaryFile(dir=download_dir, delete=False) as tmp:
+            for chunk in response.iter_bytes(chunk_size=65536):
+                tmp.write(chunk)
+    return tmp.name
+
+def track_download(file_path):
+    """Records a downloaded file for this session, removing the oldest ones beyond MAX_SESSION_DOWNLOADS."""
+    paths = st.session_state.download_paths
+    paths.append(file_path)
+    while len(paths) > MAX_SESSION_DOWNLOADS:
+        try:
+            os.remove(paths.pop(0))
+        except FileNotFoundError:
+            pass
+
+def render_download(file_name, file_path):
+    """Shows a download button for a file saved on disk, previewing HTML files inline."""
+    try:
+        with open(file_path, 'rb') as file:
+            st.download_button(
+                label=f"Download {file_name}",
+                data=file,
+                file_name=file_name,
+                mime="application/octet-stream"
+            )
+        if file_name.endswith('.html'):
+            with open(file_path, encoding='utf-8') as file:
+                st.components.v1.html(file.read(), height=300, scrolling=True)
+    except FileNotFoundError:
+        st.caption(f"{file_name} is no longer available for download.")
+
+
+# Run status polling backoff, in seconds
+POLL_INITIAL_DELAY = 0.1
+POLL_BACKOFF_FACTOR = 1.7
+POLL_MAX_DELAY = 2.0
+
 # Function to get agent response
 async def get_agent_response(assistant_id, user_message):
     try:
         with st.spinner("Processing your request..."):
             # Use the unique thread for each session
-            client.beta.threads.messages.create(
-                thread_id=st.session_state.user_thread.id,
+            thread_id = st.session_state.thread_id
+            download_dir = get_download_dir()
+
+            # Run the blocking SDK calls in worker threads so they don't stall the event loop
+            await asyncio.to_thread(
+                client.beta.threads.messages.create,
+                thread_id=thread_id,
                 role="user",
                 content=user_message,
             )
 
-            run = client.beta.threads.runs.create(
-                thread_id=st.session_state.user_thread.id,
+            run = await asyncio.to_thread(
+                client.beta.threads.runs.create,
+                thread_id=thread_id,
                 assistant_id=assistant_id,
             )
 
+            # Poll with exponential backoff so short runs return quickly without hammering the API on long ones
+            delay = POLL_INITIAL_DELAY
             while run.status in ["queued", "in_progress"]:
-                run = client.beta.threads.runs.retrieve(
-                    thread_id=st.session_state.user_thread.id,
+                await asyncio.sleep(delay)
+                delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
+                run = await asyncio.to_thread(
+                    client.beta.threads.runs.retrieve,
+                    thread_id=thread_id,
                     run_id=run.id
                 )
                 if run.status == "requires_action":
-                    run = handle_tool_outputs(run)
-                await asyncio.sleep(1)
+                    # Tool handling stays on the loop thread since it renders Streamlit elements
+                    run = await handle_tool_outputs(run)
+                    # Submitting tool outputs starts new work, so poll quickly again
+                    delay = POLL_INITIAL_DELAY
 
-            last_message = client.beta.threads.messages.list(thread_id=st.session_state.user_thread.id, limit=1).data[0]
+            messages = await asyncio.to_thread(client.beta.threads.messages.list, thread_id=thread_id, limit=1)
+            last_message = messages.data[0]
 
             formatted_response_text = ""
             download_links = []
@@ -233,11 +569,13 @@ async def get_agent_response(assistant_id, user_message):
                             if annotation.type == "file_path":
                                 file_id = annotation.file_path.file_id
                                 file_name = annotation.text.split('/')[-1]
-                                file_content = client.files.content(file_id).read()
-                                download_links.append((file_name, file_content))
+                                file_path = await asyncio.to_thread(download_to_temp_file, file_id, download_dir)
+                                track_download(file_path)
+                                download_links.append((file_name, file_path))
                     elif content.type == "image_file":
                         file_id = content.image_file.file_id
-                        image_data = client.files.content(file_id).read()
+                        image_file = await asyncio.to_thread(client.files.content, file_id)
+                        image_data = image_file.read()
                         images.append((f"{file_id}.png", image_data))
                         formatted_response_text += f"[Image generated: {file_id}.png]\n"
             else:
@@ -249,6 +587,49 @@ async def get_agent_response(assistant_id, user_message):
         st.error(traceback.format_exc())
         return f"Error: {str(e)}", [], []
 
+# Maximum number of concurrent file uploads
+MAX_UPLOAD_WORKERS = 8
+
+def upload_files(uploaded_files):
+    """Uploads the files concurrently, since each upload is an independent API call, and returns their IDs."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+        file_infos = executor.map(
+            lambda uploaded_file: client.files.create(file=uploaded_file, purpose='assistants'),
+            uploaded_files
+        )
+        return [file_info.id for file_info in file_infos]
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_assistant(file_hashes, _uploaded_files, _created):
+    """Returns an assistant for the given file contents, reusing an existing one before uploading anything.
+
+    The ID of a newly created assistant is appended to _created; on a cache hit the body does not run.
+    """
+    fingerprint = assistant_fingerprint(file_hashes)
+    assistant_id = find_assistant(fingerprint)
+    if assistant_id is None:
+        assistant_id = create_assistant(upload_files(_uploaded_files), fingerprint)
+        _created.append(assistant_id)
+    return assistant_id
+
+def assistant_exists(assistant_id):
+    """Returns whether the assistant still exists on the OpenAI side."""
+    try:
+        client.beta.assistants.retrieve(assistant_id)
+    except NotFoundError:
+        return False
+    return True
+
+def obtain_assistant(file_hashes, uploaded_files):
+    """Returns (assistant_id, reused) for the given files, recovering from a cached assistant that was deleted."""
+    created = []
+    assistant_id = get_assistant(file_hashes, uploaded_files, created)
+    if not created and not assistant_exists(assistant_id):
+        # The cached assistant was deleted; drop the stale entry and look up or create a fresh one
+        get_assistant.clear()
+        assistant_id = get_assistant(file_hashes, uploaded_files, created)
+    return assistant_id, not created
+
 # Streamlit app
 def main():
     st.title("Legal assistant")
@@ -260,16 +641,16 @@ def main():
     if assistant_choice == "Create New Assistant":
         # File uploader
         uploaded_files = st.sidebar.file_uploader("Upload files", accept_multiple_files=True)
-        file_ids = []
         if uploaded_files:
-            for uploaded_file in uploaded_files:
-                file_info = client.files.create(file=uploaded_file, purpose='assistants')
-                file_ids.append(file_info.id)
-
-        if file_ids:
             if st.sidebar.button("Create New Assistant"):
-                st.session_state.assistant_id = create_assistant(file_ids)
-                st.sidebar.success(f"New assistant created with ID: {st.session_state.assistant_id}")
+                # Key on file contents so reruns and reconnects skip re-uploading and re-creating
+                file_hashes = tuple(hashlib.blake2b(uploaded_file.getvalue()).hexdigest() for uploaded_file in uploaded_files)
+                with st.spinner("Preparing assistant..."):
+                    st.session_state.assistant_id, reused = obtain_assistant(file_hashes, uploaded_files)
+                if reused:
+                    st.sidebar.success(f"Reusing existing assistant with ID: {st.session_state.assistant_id}")
+                else:
+                    st.sidebar.success(f"New assistant created with ID: {st.session_state.assistant_id}")
         else:
             st.sidebar.warning("Please upload files to create an assistant.")
 
@@ -287,15 +668,8 @@ def main():
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             if "downloads" in message:
-                for file_name, file_content in message["downloads"]:
-                    st.download_button(
-                        label=f"Download {file_name}",
-                        data=file_content,
-                        file_name=file_name,
-                        mime="application/octet-stream"
-                    )
-                    if file_name.endswith('.html'):
-                        st.components.v1.html(file_content.decode(), height=300, scrolling=True)
+                for file_name, file_path in message["downloads"]:
+                    render_download(file_name, file_path)
             if "images" in message:
                 for image_name, image_data in message["images"]:
                     st.image(image_data)
@@ -314,18 +688,13 @@ def main():
         if 'assistant_id' in st.session_state:
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
-                response, download_links, images = asyncio.run(get_agent_response(st.session_state.assistant_id, prompt))
+                response, download_links, images = get_event_loop().run_until_complete(
+                    get_agent_response(st.session_state.assistant_id, prompt)
+                )
                 message_placeholder.markdown(response)
                 
-                for file_name, file_content in download_links:
-                    st.download_button(
-                        label=f"Download {file_name}",
-                        data=file_content,
-                        file_name=file_name,
-                        mime="application/octet-stream"
-                    )
-                    if file_name.endswith('.html'):
-                        st.components.v1.html(file_content.decode(), height=300, scrolling=True)
+                for file_name, file_path in download_links:
+                    render_download(file_name, file_path)
                 
                 for image_name, image_data in images:
                     st.image(image_data)